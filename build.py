@@ -1,28 +1,41 @@
-import base64
-from collections.abc import Sequence
+import asyncio
+from collections import OrderedDict
+from collections.abc import AsyncIterator, Sequence
+from contextlib import asynccontextmanager, suppress
 from datetime import datetime
+import hashlib
 from io import BytesIO
 from pathlib import Path
-from typing import TYPE_CHECKING, Literal
+from typing import TYPE_CHECKING, Any, ClassVar, Literal
+from urllib.parse import quote
 
-import anyio
 from httpx import AsyncClient
 import jinja2
+from nonebot import get_driver
 from nonebot_plugin_saa import Image, MessageSegmentFactory, Text
 from PIL import Image as PILImage
+import qrcode
 from pydantic import BaseModel
 from yarl import URL
 
 from nonebot_bison.compat import model_validator
 from nonebot_bison.theme import Theme, ThemeRenderError, ThemeRenderUnsupportError
-from nonebot_bison.theme.utils import convert_to_qr, web_embed_image
+from nonebot_bison.theme.utils import web_embed_image
 from nonebot_bison.utils import is_pics_mergable, pic_merge
 
+try:
+    # pybase64 提供 SIMD 加速的 base64 编码，未安装时退回标准库
+    import pybase64 as base64
+except ImportError:
+    import base64
+
 if TYPE_CHECKING:
+    from playwright.async_api import Page, Route
+
     from nonebot_bison.post import Post
 
 
-async def embed_image_as_data_url(image_path: Path) -> str:
+def embed_image_as_data_url(image_path: Path) -> str:
     """读取图片文件并返回base64数据URL字符串
 
     Args:
@@ -34,19 +47,163 @@ async def embed_image_as_data_url(image_path: Path) -> str:
     if not image_path.exists():
         return ""
 
-    async with await anyio.open_file(image_path, "rb") as f:
-        image_data = base64.b64encode(await f.read()).decode()
-        return f"data:image/png;base64,{image_data}"
+    return embed_many([image_path.read_bytes()])[0]
+
+
+def embed_many(pngs: list[bytes]) -> list[str]:
+    """将多张PNG图片批量转换为base64数据URL字符串"""
+    # 先在 bytes 上拼接前缀再解码一次，避免额外生成完整大小的中间 str
+    prefix = b"data:image/png;base64,"
+    return [(prefix + base64.b64encode(memoryview(buf))).decode("ascii") for buf in pngs]
+
+
+def embed_svg_as_data_url(svg_path: Path) -> str:
+    """读取SVG文件并返回URL转义的数据URL字符串
 
-async def embed_svg_as_data_url(svg_path: Path) -> str:
-    """读取SVG文件并返回base64数据URL字符串"""
+    SVG 本身是文本，直接转义比 base64 更短，也省去一次编码
+    """
     if not svg_path.exists():
         return ""
 
-    async with await anyio.open_file(svg_path, "r", encoding='utf-8') as f:
-        svg_content = await f.read()
-        encoded_svg = base64.b64encode(svg_content.encode('utf-8')).decode()
-        return f"data:image/svg+xml;base64,{encoded_svg}"
+    svg_content = svg_path.read_text(encoding="utf-8")
+    # `#` 会被当作片段标识符，`"` 会截断 HTML 属性，二者都需要转义
+    return "data:image/svg+xml;utf8," + quote(svg_content, safe=":/?[]@!$&'()*+,;=")
+
+
+def _qr_png(data: str, box_size: int = 10, border: int = 2) -> bytes:
+    """直接由二维码矩阵构建灰度PNG，跳过 qrcode 的图片工厂
+
+    纠错等级、版本与模块大小与 `convert_to_qr` 保持一致，只改变 PNG 的编码方式
+    """
+    qr = qrcode.QRCode(
+        version=1,
+        error_correction=qrcode.constants.ERROR_CORRECT_L,
+        border=border,
+    )
+    qr.add_data(data)
+    qr.make(fit=True)
+    matrix = qr.get_matrix()
+    size = len(matrix)
+    pixels = bytes(0 if cell else 255 for row in matrix for cell in row)
+    img = PILImage.frombytes("L", (size, size), pixels)
+    img = img.resize((size * box_size, size * box_size), PILImage.Resampling.NEAREST)
+    with BytesIO() as buf:
+        img.save(buf, "PNG", optimize=False, compress_level=1)
+        return buf.getvalue()
+
+
+def _qr_data_url(url: str) -> str:
+    """生成链接二维码的数据URL"""
+    return embed_many([_qr_png(url)])[0]
+
+
+_QR_CACHE_SIZE = 512
+_qr_cache: OrderedDict[str, str] = OrderedDict()
+
+
+async def _qr_code(url: str) -> str:
+    """按链接缓存二维码，命中时直接在事件循环中返回，未命中才放到线程中生成"""
+    if (cached := _qr_cache.get(url)) is not None:
+        _qr_cache.move_to_end(url)
+        return cached
+    # 二维码生成是纯 CPU 计算，放到线程中避免阻塞事件循环
+    data_url = await asyncio.to_thread(_qr_data_url, url)
+    _qr_cache[url] = data_url
+    if len(_qr_cache) > _QR_CACHE_SIZE:
+        _qr_cache.popitem(last=False)
+    return data_url
+
+
+LOCAL_IMAGE_PREFIX = "https://local/img/"
+
+
+def _image_bytes(pic: bytes | Path | BytesIO) -> bytes:
+    """取出图片的原始字节"""
+    match pic:
+        case bytes():
+            return pic
+        case Path():
+            return pic.read_bytes()
+        case BytesIO():
+            return pic.getvalue()
+        case _:
+            raise TypeError(f"unsupported image type: {type(pic)}")
+
+
+def _local_image_url(pic: bytes | Path | BytesIO, resources: dict[str, bytes]) -> str:
+    """为图片分配本地 URL，渲染时由 Playwright 路由直接返回原始字节，避免 base64 内联"""
+    data = _image_bytes(pic)
+    url = f"{LOCAL_IMAGE_PREFIX}{hashlib.sha1(data).hexdigest()}.png"
+    resources[url] = data
+    return url
+
+
+_PAGE_POOL_SIZE = 4
+# 池中页面共用同一组创建参数，每次渲染前只需重置视口
+_INITIAL_VIEWPORT = {"width": 450, "height": 600}  # 先以最小高度布局，渲染后再按实际内容高度调整
+_PAGE_OPTIONS: dict[str, Any] = {
+    "device_scale_factor": 2,
+    "viewport": _INITIAL_VIEWPORT,
+    "base_url": (Path(__file__).parent / "templates").as_uri(),
+}
+MAX_VIEWPORT_HEIGHT = 4000
+_page_pool: "asyncio.Queue[Page] | None" = None
+
+
+@asynccontextmanager
+async def _pooled_page() -> AsyncIterator["Page"]:
+    """从页面池中取出可复用的页面，用完后放回，避免每次渲染都新建浏览器上下文"""
+    global _page_pool
+    from nonebot_plugin_htmlrender import get_browser
+
+    if _page_pool is None:
+        _page_pool = asyncio.Queue(maxsize=_PAGE_POOL_SIZE)
+
+    page: "Page | None" = None
+    while page is None and not _page_pool.empty():
+        candidate = _page_pool.get_nowait()
+        if not candidate.is_closed():
+            page = candidate
+    if page is None:
+        browser = await get_browser()
+        page = await browser.new_page(**_PAGE_OPTIONS)
+
+    reusable = False
+    try:
+        yield page
+        reusable = True
+    finally:
+        # 出错的页面状态不可控，直接关闭
+        if reusable and not page.is_closed() and not _page_pool.full():
+            _page_pool.put_nowait(page)
+        else:
+            await page.close()
+
+
+@get_driver().on_shutdown
+async def _close_page_pool() -> None:
+    """关闭时主动释放池中的页面"""
+    if _page_pool is None:
+        return
+    while not _page_pool.empty():
+        page = _page_pool.get_nowait()
+        if not page.is_closed():
+            with suppress(Exception):
+                await page.close()
+
+
+class _BestEffortBytecodeCache(jinja2.FileSystemBytecodeCache):
+    """写入失败（如安装目录只读）时静默跳过的字节码缓存"""
+
+    def dump_bytecode(self, bucket: jinja2.bccache.Bucket) -> None:
+        try:
+            super().dump_bytecode(bucket)
+        except OSError:
+            pass
+
+
+async def _no_pics() -> list[str | bytes | Path | BytesIO]:
+    return []
 
 
 class UserInfo(BaseModel):
@@ -91,12 +248,52 @@ class PopinPartyTheme(Theme):
     parent_path: Path = Path(__file__).parent
     template_name: str = "popinparty.html.jinja"
 
-    async def parse(self, post: "Post") -> tuple[PopinPartyCard, list[str | bytes | Path | BytesIO]]:
-        """解析 Post 为 PopinPartyCard 与处理好的图片列表"""
+    _template_env: ClassVar[jinja2.Environment | None] = None
+    _template: ClassVar[jinja2.Template | None] = None
+    _bang_dream_logo: ClassVar[str | None] = None
+
+    def _build_template_env(self, bytecode_cache: jinja2.BytecodeCache | None) -> jinja2.Environment:
+        return jinja2.Environment(
+            loader=jinja2.FileSystemLoader(self.template_path),
+            enable_async=True,
+            auto_reload=False,
+            cache_size=-1,
+            bytecode_cache=bytecode_cache,
+        )
+
+    def _bytecode_cache(self) -> jinja2.BytecodeCache | None:
+        """编译结果缓存到磁盘，进程重启后无需重新解析模板；目录无法创建时不使用缓存"""
+        cache_dir = self.parent_path / ".jinja_cache"
+        try:
+            cache_dir.mkdir(exist_ok=True)
+        except OSError:
+            return None
+        return _BestEffortBytecodeCache(directory=str(cache_dir))
+
+    def _get_template(self) -> jinja2.Template:
+        """获取编译好的模板，Environment 与 Template 在类上只创建一次"""
+        # 只看本类自己的缓存，子类可能使用不同的 template_path / template_name
+        cls = type(self)
+        template = cls.__dict__.get("_template")
+        if template is None:
+            template_env = cls.__dict__.get("_template_env")
+            if template_env is None:
+                template_env = self._build_template_env(self._bytecode_cache())
+                cls._template_env = template_env
+            template = template_env.get_template(self.template_name)
+            cls._template = template
+        return template
+
+    async def parse(
+        self, post: "Post"
+    ) -> tuple[PopinPartyCard, list[str | bytes | Path | BytesIO], dict[str, bytes]]:
+        """解析 Post 为 PopinPartyCard、处理好的图片列表，以及本地 URL 到图片字节的映射"""
         # 基础验证
         if not post.nickname:
             raise ThemeRenderUnsupportError("post.nickname is None")
         
+        resources: dict[str, bytes] = {}
+
         # 处理头像
         avatar_url = None
         if post.avatar:
@@ -104,7 +301,7 @@ class PopinPartyTheme(Theme):
                 avatar_url = post.avatar
             else:
                 # 处理非URL头像
-                avatar_url = web_embed_image(post.avatar)
+                avatar_url = _local_image_url(post.avatar, resources)
 
         # 创建用户信息 - 充分利用所有可用字段
         user = UserInfo(
@@ -114,18 +311,29 @@ class PopinPartyTheme(Theme):
         )
         
         http_client = await post.platform.ctx.get_client_for_static()
-        images: list[str | bytes | Path | BytesIO] = []
         image_urls: list[str] = []
-        
+
+        # 主内容与转发的图片合并互不依赖，并发进行
+        images, repost_images = await asyncio.gather(
+            self.merge_pics(post.images, http_client) if post.images else _no_pics(),
+            self.merge_pics(post.repost.images, http_client)
+            if post.repost and post.repost.images
+            else _no_pics(),
+        )
+        # merge_pics 可能原样返回 post.images，不能就地修改
+        if repost_images:
+            images = [*images, *repost_images]
+
         # 处理主内容图片
         if post.images:
-            images = await self.merge_pics(post.images, http_client)
-            # 转换为URL用于模板显示
-            for img in post.images:
-                if isinstance(img, str):
-                    image_urls.append(img)
-                else:
-                    image_urls.append(web_embed_image(img))
+            # 转换为URL用于模板显示，链接原样保留，其余图片在线程中并发处理后按原顺序填回
+            image_urls = [img if isinstance(img, str) else "" for img in post.images]
+            blobs = [(i, img) for i, img in enumerate(post.images) if not isinstance(img, str)]
+            embedded = await asyncio.gather(
+                *(asyncio.to_thread(_local_image_url, img, resources) for _, img in blobs)
+            )
+            for (i, _), url in zip(blobs, embedded):
+                image_urls[i] = url
 
         # 创建内容 - 使用 title 和 content
         content_text = ""
@@ -147,8 +355,6 @@ class PopinPartyTheme(Theme):
             
             # 处理转发图片
             if post.repost.images:
-                repost_images = await self.merge_pics(post.repost.images, http_client)
-                images.extend(repost_images)
                 for img in post.repost.images:
                     if isinstance(img, str):
                         retweet_images.append(img)
@@ -158,7 +364,7 @@ class PopinPartyTheme(Theme):
                 if isinstance(post.repost.avatar, str):
                     retweet_avatar = post.repost.avatar
                 else:
-                    retweet_avatar = web_embed_image(post.repost.avatar)
+                    retweet_avatar = _local_image_url(post.repost.avatar, resources)
             
             # 构建转发内容文本
             retweet_content = ""
@@ -179,17 +385,19 @@ class PopinPartyTheme(Theme):
         else:
             timestamp_str = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
 
+        qr_code = await _qr_code(post.url or "No URL")
+
         # 创建卡片
         card = PopinPartyCard(
             user=user,
             content=content,
             retweet=retweet,
-            qr_code=web_embed_image(convert_to_qr(post.url or "No URL", back_color=(255, 255, 255))),
+            qr_code=qr_code,
             timestamp=timestamp_str,
-            platform=post.platform.name
+            platform=post.platform.name,
         )
 
-        return card, images
+        return card, images, resources
 
     @staticmethod
     async def merge_pics(
@@ -200,7 +408,7 @@ class PopinPartyTheme(Theme):
             pics = await pic_merge(images, client)
         else:
             pics = images
-        return list(pics)
+        return pics if isinstance(pics, list) else list(pics)
 
     @staticmethod
     def extract_head_pic(pics: list[str | bytes | Path | BytesIO]) -> str:
@@ -209,10 +417,13 @@ class PopinPartyTheme(Theme):
 
     @staticmethod
     def card_link(head_pic: PILImage.Image, card_body: PILImage.Image) -> PILImage.Image:
-        """将头像与卡片合并"""
+        """将头像与卡片合并
+
+        缩放使用 BILINEAR，安装 `pillow-simd` 替换 `Pillow` 可获得 SIMD 加速的缩放实现
+        """
 
         def resize_image(img: PILImage.Image, size: tuple[int, int]) -> PILImage.Image:
-            return img.resize(size)
+            return img.resize(size, PILImage.Resampling.BILINEAR, reducing_gap=2.0)
 
         # 统一图片宽度
         head_pic_w, head_pic_h = head_pic.size
@@ -223,54 +434,67 @@ class PopinPartyTheme(Theme):
         else:
             card_body = resize_image(card_body, (head_pic_w, int(card_body_h * head_pic_w / card_body_w)))
 
-        # 合并图片
-        card = PILImage.new("RGBA", (head_pic.width, head_pic.height + card_body.height))
-        card.paste(head_pic, (0, 0))
-        card.paste(card_body, (0, head_pic.height))
+        def has_alpha(img: PILImage.Image) -> bool:
+            return img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+
+        # 合并图片，两张图都不带透明通道时使用 RGB 画布
+        mode = "RGBA" if has_alpha(head_pic) or has_alpha(card_body) else "RGB"
+        card = PILImage.new(mode, (head_pic.width, head_pic.height + card_body.height))
+        card.paste(head_pic if head_pic.mode == mode else head_pic.convert(mode), (0, 0))
+        card.paste(card_body if card_body.mode == mode else card_body.convert(mode), (0, head_pic.height))
         return card
 
     async def render(self, post: "Post") -> list[MessageSegmentFactory]:
-        card, merged_images = await self.parse(post)
+        card, merged_images, resources = await self.parse(post)
 
-        from nonebot_plugin_htmlrender import get_new_page
+        template = self._get_template()
 
-        template_env = jinja2.Environment(
-            loader=jinja2.FileSystemLoader(self.template_path),
-            enable_async=True,
-        )
-        template = template_env.get_template(self.template_name)
+        # 获取邦多利logo，只在首次渲染时读取
+        # 只看本类自己的缓存，避免子类沿继承拿到父类读取的 logo
+        cls = type(self)
+        bang_dream_logo = cls.__dict__.get("_bang_dream_logo")
+        if bang_dream_logo is None:
+            bang_dream_logo = embed_svg_as_data_url(self.template_path / "bang-dream-seeklogo.svg")
+            cls._bang_dream_logo = bang_dream_logo
 
-        # 获取邦多利logo
-        bang_dream_logo = await embed_svg_as_data_url(self.template_path / "bang-dream-seeklogo.svg")
-        
         html = await template.render_async(
             card=card,
             bang_dream_logo=bang_dream_logo
         )
-        
-        # 根据内容动态调整视口大小
-        base_height = 600
-        if card.content.images:
-            base_height += len(card.content.images) * 50  # 根据图片数量增加高度
-        if card.retweet:
-            base_height += 150  # 转发内容额外高度
-        
-        pages = {
-            "device_scale_factor": 2,
-            "viewport": {"width": 450, "height": min(base_height, 1200)},  # 限制最大高度
-            "base_url": self.template_path.as_uri(),
-        }
-        
+
+
         try:
-            async with get_new_page(**pages) as page:
-                await page.goto("about:blank")
-                await page.set_content(html)
-                await page.wait_for_timeout(200)  # 确保所有资源加载完成
-                screenshot = await page.screenshot(
-                    type="jpeg",
-                    quality=90,
-                    full_page=True
-                )
+            async with _pooled_page() as page:
+                # 复用的页面保留着上一次渲染的视口
+                if page.viewport_size != _INITIAL_VIEWPORT:
+                    await page.set_viewport_size(_INITIAL_VIEWPORT)
+
+                async def serve_local_image(route: "Route") -> None:
+                    body = resources.get(route.request.url)
+                    if body is None:
+                        await route.abort()
+                    else:
+                        await route.fulfill(status=200, body=body, content_type="image/png")
+
+                await page.route(f"{LOCAL_IMAGE_PREFIX}**", serve_local_image)
+                try:
+                    await page.goto("about:blank")
+                    await page.set_content(html, wait_until="load")
+                    # wait_until="load" 已等待链接图片与字体样式表，这里再等待字体文件本身就绪
+                    await page.evaluate("document.fonts.ready")
+                    # 将视口调整为内容实际高度，避免 full_page 额外的布局与光栅化
+                    content_height = await page.evaluate("document.documentElement.scrollHeight")
+                    # 超高的卡片不放大视口，改用 full_page 截取完整内容，避免底部被裁掉
+                    full_page = content_height > MAX_VIEWPORT_HEIGHT
+                    if not full_page:
+                        await page.set_viewport_size({"width": 450, "height": content_height})
+                    screenshot = await page.screenshot(
+                        type="jpeg",
+                        quality=90,
+                        full_page=full_page,
+                    )
+                finally:
+                    await page.unroute(f"{LOCAL_IMAGE_PREFIX}**", serve_local_image)
         except Exception as e:
             raise ThemeRenderError(f"Render error: {e}") from e
 